@@ -1,62 +1,363 @@
+import base64
+import binascii
+import functools
 import json
-import boto3
+import logging
+import re
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import urllib.error
+import urllib.request
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+from urllib.parse import urlparse
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+# python-dotenv is only needed to load a local .env file; Lambda provides the environment directly
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    pass
+else:
+    load_dotenv()
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 table_name = os.getenv('TABLE_NAME')
+queue_url = os.getenv('QUEUE_URL')
+webhook_id = os.getenv('WEBHOOK_ID')
+
+def create_boto_config():
+    """
+    :return: botocore Config with short timeouts and bounded retries, suited to a webhook that must answer quickly
+    """
+    from botocore.config import Config
+    return Config(
+        retries={'max_attempts': 2, 'mode': 'standard'},
+        connect_timeout=1,
+        read_timeout=2,
+        tcp_keepalive=True,
+        max_pool_connections=4
+    )
+
+# Created on first use and then reused for the life of the container
+_table = None
+
+def get_table():
+    """
+    Deferring creation keeps the boto3 import out of cold starts for events that never write a record.
+
+    :return: The DynamoDB table named by TABLE_NAME
+    """
+    global _table
+    if _table is None:
+        if not table_name:
+            raise RuntimeError("TABLE_NAME environment variable is not set.")
+        import boto3
+        _table = boto3.resource('dynamodb', config=create_boto_config()).Table(table_name)
+    return _table
+
+_sqs = None
+
+def get_sqs():
+    """
+    :return: The SQS client, created on first use and reused for the life of the container
+    """
+    global _sqs
+    if _sqs is None:
+        import boto3
+        _sqs = boto3.client('sqs', config=create_boto_config())
+    return _sqs
+
+# With Lambda SnapStart, import the AWS SDK before the snapshot is taken. Clients are still created
+# after restore, so no credentials or open connections are captured in the snapshot.
+try:
+    from snapshot_restore_py import register_before_snapshot
+except ImportError:
+    pass
+else:
+    @register_before_snapshot
+    def _import_aws_sdk():
+        import boto3  # noqa: F401
+        import botocore.config  # noqa: F401
+
+# Public keys of PayPal signing certificates, keyed by certificate URL
+_cert_cache = {}
+_CERT_CACHE_SIZE = 8
+
+# PayPal serves webhook signing certificates only from these hosts and path
+_PAYPAL_CERT_HOSTS = frozenset(('api.paypal.com', 'api.sandbox.paypal.com'))
+_PAYPAL_CERT_PATH = '/v1/notifications/certs/'
+_PAYPAL_CERT_SUBJECTS = frozenset(('messageverificationcerts.paypal.com', 'messageverificationcerts.sandbox.paypal.com'))
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Turns redirects into HTTP errors so a certificate is only ever read from the URL that was checked."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+_cert_opener = urllib.request.build_opener(_NoRedirectHandler)
+
+def _is_paypal_cert_url(cert_url):
+    parsed = urlparse(cert_url)
+    return (
+        parsed.scheme == 'https'
+        and parsed.hostname in _PAYPAL_CERT_HOSTS
+        and parsed.port is None
+        and parsed.path.startswith(_PAYPAL_CERT_PATH)
+        and not parsed.query
+        and not parsed.fragment
+    )
+
+def _check_paypal_certificate(certificate):
+    """
+    :param certificate: Parsed signing certificate
+    :raises ValueError: If the certificate was not issued to PayPal's message verification host or is not currently valid
+    """
+    from cryptography.x509.oid import NameOID
+
+    subjects = {attribute.value for attribute in certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)}
+    if not subjects & _PAYPAL_CERT_SUBJECTS:
+        raise ValueError("Certificate subject is not a PayPal message verification host.")
+
+    try:
+        not_before, not_after = certificate.not_valid_before_utc, certificate.not_valid_after_utc
+    except AttributeError:
+        # cryptography before 42 only has the naive UTC attributes
+        not_before = certificate.not_valid_before.replace(tzinfo=timezone.utc)
+        not_after = certificate.not_valid_after.replace(tzinfo=timezone.utc)
+
+    if not not_before <= datetime.now(timezone.utc) <= not_after:
+        raise ValueError("Certificate is not currently valid.")
+
+def get_paypal_public_key(cert_url):
+    """
+    Downloads and checks a signing certificate once; later webhooks signed with it reuse the cached key.
+
+    :param cert_url: Certificate URL from the PAYPAL-CERT-URL header, already checked by _is_paypal_cert_url
+    :return: The certificate's public key
+    :raises ValueError: If the URL redirects or the certificate fails the subject and validity checks
+    """
+    public_key = _cert_cache.get(cert_url)
+    if public_key is None:
+        from cryptography import x509
+
+        try:
+            with _cert_opener.open(cert_url, timeout=2) as response:
+                certificate = x509.load_pem_x509_certificate(response.read())
+        except urllib.error.HTTPError as e:
+            if 300 <= e.code < 400:
+                raise ValueError("Certificate URL redirected.")
+            raise
+        _check_paypal_certificate(certificate)
+        public_key = certificate.public_key()
+
+        if len(_cert_cache) >= _CERT_CACHE_SIZE:
+            _cert_cache.pop(next(iter(_cert_cache)))
+        _cert_cache[cert_url] = public_key
+
+    return public_key
+
+def verify_paypal_webhook(headers, raw_body):
+    """
+    :param headers: Request headers carrying the PAYPAL-* transmission headers
+    :param raw_body: Request body exactly as PayPal sent it
+    :return: True if the transmission signature is valid for WEBHOOK_ID, or if WEBHOOK_ID is not set
+    """
+    if not webhook_id:
+        return True
+    if not isinstance(raw_body, (str, bytes)):
+        return False
+    if isinstance(raw_body, str):
+        raw_body = raw_body.encode()
+
+    headers = {key.lower(): value for key, value in headers.items()}
+    cert_url = headers.get('paypal-cert-url', '')
+    if headers.get('paypal-auth-algo') != 'SHA256withRSA' or not _is_paypal_cert_url(cert_url):
+        return False
+
+    message = '|'.join((
+        headers.get('paypal-transmission-id', ''),
+        headers.get('paypal-transmission-time', ''),
+        webhook_id,
+        str(zlib.crc32(raw_body))
+    )).encode()
+
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    try:
+        signature = base64.b64decode(headers.get('paypal-transmission-sig', ''), validate=True)
+        get_paypal_public_key(cert_url).verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+    except (InvalidSignature, binascii.Error, ValueError):
+        return False
+
+    return True
+
+# custom_id is a '|' separated list of 'key:value' segments; segments without a ':' are skipped
+_CUSTOM_ID_RE = re.compile(r'([^:|]+):([^|]*)')
+
+# Shared read-only default for missing nested objects, so lookups do not allocate a new dict
+_EMPTY = MappingProxyType({})
+
+_REQUIRED_FIELDS = ('event_type', 'resource')
+_REQUIRED_FIELD_SET = frozenset(_REQUIRED_FIELDS)
+_JSON_CONTENT_TYPE = 'application/json'
 
 def validate_event_body(body):
-    required_fields = ['event_type', 'resource']
-    for field in required_fields:
-        if field not in body:
-            raise ValueError(f"Missing required field: {field}")
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object.")
+    if not body.keys() >= _REQUIRED_FIELD_SET:
+        missing = next(field for field in _REQUIRED_FIELDS if field not in body)
+        raise ValueError(f"Missing required field: {missing}")
+    if not isinstance(body['event_type'], str):
+        raise ValueError("Field event_type must be a string.")
+    if not isinstance(body['resource'], dict):
+        raise ValueError("Field resource must be an object.")
+
+    validate_resource = _RESOURCE_VALIDATORS.get(body['event_type'])
+    if validate_resource is not None:
+        validate_resource(body['resource'])
+
+def validate_subscription_resource(resource):
+    if resource.get('id') is None:
+        raise ValueError("Missing id in resource.")
+
+def _is_money_string(value):
+    """
+    PayPal sends amounts as decimal strings. A JSON number would already have lost precision as a float,
+    and NaN or Infinity would be stored as the net amount, so both are rejected.
+
+    :param value: Amount field from the resource
+    :return: True if value is a string holding a finite decimal number
+    """
+    if not isinstance(value, str):
+        return False
+    try:
+        return Decimal(value).is_finite()
+    except InvalidOperation:
+        return False
+
+def validate_sale_resource(resource):
+    if resource.get('billing_agreement_id') is None:
+        raise ValueError("Missing billing_agreement_id in resource.")
+
+    amount = resource.get('amount')
+    if not isinstance(amount, dict) or 'total' not in amount or 'currency' not in amount:
+        raise ValueError("Missing amount total or currency in resource.")
+
+    transaction_fee = (resource.get('transaction_fee') or _EMPTY).get('value', '0.00')
+    if not _is_money_string(amount['total']) or not _is_money_string(transaction_fee or '0.00'):
+        raise ValueError(f"Invalid amount '{amount['total']}' or transaction fee '{transaction_fee}'.")
+
+def validate_order_resource(resource):
+    purchase_units = resource.get('purchase_units')
+    if not purchase_units or not isinstance(purchase_units, list) or not isinstance(purchase_units[0], dict):
+        raise ValueError("Missing purchase_units in resource.")
+
+# Checks that depend on the event type, run before a webhook is processed or queued
+_RESOURCE_VALIDATORS = {
+    'BILLING.SUBSCRIPTION.CREATED': validate_subscription_resource,
+    'PAYMENT.SALE.COMPLETED': validate_sale_resource,
+    'CHECKOUT.ORDER.APPROVED': validate_order_resource
+}
 
 def validate_content_type(headers):
     content_type = headers.get('Content-Type')
-    if content_type != 'application/json':
+    if content_type != _JSON_CONTENT_TYPE:
         raise ValueError("Invalid Content-Type. Expected 'application/json'.")
 
-def save_record(billing_agreement_id, data_type, record_data):
+def _parse_custom_id(custom_id):
+    """
+    :param custom_id: String in the form 'key:value|key:value|...'
+    :return: Dict of the parsed key/value pairs
+    """
+    pairs = _CUSTOM_ID_RE.findall(custom_id or '')
+
+    if custom_id and logger.isEnabledFor(logging.DEBUG):
+        skipped = custom_id.count('|') + 1 - len(pairs)
+        if skipped:
+            logger.debug("Skipped %d malformed custom_id segments", skipped)
+
+    return dict(pairs)
+
+@functools.lru_cache(maxsize=1024)
+def _extract_user_fields(custom_id):
+    """
+    Cached so that redelivered webhooks with the same custom_id are not parsed again.
+
+    :param custom_id: String in the form 'key:value|key:value|...'
+    :return: Tuple of (purpose, user_email, user_name)
+    """
+    parts = _parse_custom_id(custom_id)
+
+    purpose = parts.get('purpose', 'Unknown_Purpose')
+    user_email = parts.get('email', 'Unknown_Email')
+    user_name = parts.get('user_name', 'Unknown_Name')
+
+    return purpose, user_email, user_name
+
+def save_record(billing_agreement_id, data_type, record_data, items=None):
     """
     :param billing_agreement_id: Unique ID for the subscription or payment
     :param data_type: Type of data being saved ('subscription' or 'payment')
     :param record_data: The data to save
+    :param items: Optional list collecting items for a batched write; the item is written directly to the table when omitted
     """
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table_name)
-    
+    if billing_agreement_id is None:
+        raise ValueError(f"Missing id for {data_type} record.")
+
     item = {
         'id': billing_agreement_id,
         'data_type': data_type,
         **record_data
     }
-    
-    table.put_item(Item=item)
 
-def process_subscription_created(resource):
+    if items is not None:
+        # BatchWriteItem does not support conditions; rewriting a redelivered item is harmless
+        items.append(item)
+        return
+
+    from botocore.exceptions import ClientError
+
+    # PayPal redelivers webhooks; a redelivery carries the same create_time as the stored item
+    try:
+        get_table().put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(#id) OR #create_time <> :create_time',
+            ExpressionAttributeNames={'#id': 'id', '#create_time': 'create_time'},
+            ExpressionAttributeValues={':create_time': item.get('create_time')}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.info("Skipping duplicate %s record: %s", data_type, billing_agreement_id)
+
+def process_subscription_created(resource, items=None):
     """
     :param resource: Subscription resource data from PayPal
+    :param items: Optional list collecting items for a batched write, passed through to save_record
     """
     billing_agreement_id = resource.get('id')
 
     subscription_create_time = resource.get('create_time')
 
-    custom_id = resource.get("custom_id", "")
+    custom_id = resource.get("custom_id") or ""
 
-    parts = {}
-    for segment in custom_id.split('|'):
-        subparts = segment.split(':', 1)
-        if len(subparts) == 2:
-            key, value = subparts
-            parts[key] = value
-        else:
-            print(f"Skipping invalid segment: '{segment}' - expected format key:value")
-
-    purpose = parts.get('purpose', 'Unknown_Purpose')
-    user_email = parts.get('email', 'Unknown_Email')
-    user_name = parts.get('user_name', 'Unknown_Name')
+    purpose, user_email, user_name = _extract_user_fields(custom_id)
 
     subscriber_info = {
         'user_name': user_name,
@@ -65,32 +366,23 @@ def process_subscription_created(resource):
         'create_time': subscription_create_time
     }
 
-    save_record(billing_agreement_id, 'subscription', subscriber_info)
+    save_record(billing_agreement_id, 'subscription', subscriber_info, items)
 
-def process_subscription_payment(resource):
+def process_subscription_payment(resource, items=None):
     """
     :param resource: Payment resource data from PayPal
+    :param items: Optional list collecting items for a batched write, passed through to save_record
     """
     billing_agreement_id = resource.get('billing_agreement_id')
-    amount_value = resource['amount']['total']
-    amount_currency = resource['amount']['currency']
-    transaction_fee = resource.get('transaction_fee', {}).get('value', '0.00')
-    net_amount = float(amount_value) - float(transaction_fee)
-
-    custom_id = resource.get("custom", "")
-
-    parts = {}
-    for segment in custom_id.split('|'):
-        subparts = segment.split(':', 1)
-        if len(subparts) == 2:
-            key, value = subparts
-            parts[key] = value
-        else:
-            print(f"Skipping invalid segment: '{segment}' - expected format key:value")
+    amount = resource['amount']
+    amount_value = amount['total']
+    amount_currency = amount['currency']
+    transaction_fee = (resource.get('transaction_fee') or _EMPTY).get('value', '0.00')
+    net_amount = Decimal(amount_value) - Decimal(transaction_fee or '0.00')
 
-    purpose = parts.get('purpose', 'Unknown_Purpose')
-    user_email = parts.get('email', 'Unknown_Email')
-    user_name = parts.get('user_name', 'Unknown_Name')
+    custom_id = resource.get("custom") or ""
+
+    purpose, user_email, user_name = _extract_user_fields(custom_id)
 
     payment_info = {
         'purpose': purpose,
@@ -99,110 +391,213 @@ def process_subscription_payment(resource):
         'amount_value': amount_value,
         'amount_currency': amount_currency,
         'transaction_fee': transaction_fee,
-        'net_amount': str(net_amount),
+        'net_amount': format(net_amount, 'f'),
         'create_time': resource.get('create_time', 'Unknown_Time')
     }
 
-    save_record(billing_agreement_id, 'payment', payment_info)
+    save_record(billing_agreement_id, 'payment', payment_info, items)
 
-def process_order_approved(resource):
-    try:
-        id = resource.get('id', 'Unknown_ID')
-        purchase_units = resource.get('purchase_units', [])
-        if not purchase_units:
-            raise ValueError("Missing purchase_units in resource.")
-
-        purchase_unit = purchase_units[0]
-        amount = purchase_unit.get('amount', {})
-        amount_value = amount.get('value', '0.00')
-        amount_currency = amount.get('currency_code', 'USD')
-
-        payer = resource.get('payer', {})
-        payer_email = payer.get('email_address', 'Unknown_Email')
-        name_dict = payer.get('name', {})
-        payer_name = (name_dict.get('given_name', 'Unknown_Name') + ' ' + name_dict.get('surname', 'Unknown_Surname'))
-        
-        captures = purchase_unit.get('payments', {}).get('captures', [])
-        first_capture = captures[0] if captures else {}
-
-        seller_breakdown = first_capture.get('seller_receivable_breakdown', {})
-        payment_fee = seller_breakdown.get('paypal_fee', {}).get('value', '0.00')
-        net_amount = seller_breakdown.get('net_amount', {}).get('value', '0.00')
-
-        custom_id = purchase_unit.get("custom_id", "")
-
-        parts = {}
-        for segment in custom_id.split('|'):
-            subparts = segment.split(':', 1)
-            if len(subparts) == 2:
-                key, value = subparts
-                parts[key] = value
-            else:
-                print(f"Skipping invalid segment: '{segment}' - expected format key:value")
-
-        purpose = parts.get('purpose', 'Unknown_Purpose')
-        user_email = parts.get('email', 'Unknown_Email')
-        user_name = parts.get('user_name', 'Unknown_Name')
-
-        payment_info_db = {
-            'purpose': purpose,
-            'user_name': user_name,
-            'payer_name': payer_name,
-            'user_email': user_email,
-            'payer_email': payer_email,
-            'amount_value': amount_value,
-            'amount_currency': amount_currency,
-            'transaction_fee': payment_fee,
-            'net_amount': net_amount,
-            'create_time': resource.get('create_time', 'Unknown_Time')
-        }
+def process_order_approved(resource, items=None):
+    id = resource.get('id', 'Unknown_ID')
+    purchase_unit = resource['purchase_units'][0]
+    amount = purchase_unit.get('amount') or _EMPTY
+    amount_value = amount.get('value', '0.00')
+    amount_currency = amount.get('currency_code', 'USD')
 
-        save_record(id, 'payment', payment_info_db)
+    payer = resource.get('payer') or _EMPTY
+    payer_email = payer.get('email_address', 'Unknown_Email')
+    name_dict = payer.get('name') or _EMPTY
+    payer_name = ' '.join((name_dict.get('given_name', 'Unknown_Name'), name_dict.get('surname', 'Unknown_Surname')))
+    
+    captures = (purchase_unit.get('payments') or _EMPTY).get('captures') or ()
+    first_capture = captures[0] if captures else _EMPTY
 
-    except Exception as e:
-        print(f"Error processing order approved: {e}")
-        raise
+    seller_breakdown = first_capture.get('seller_receivable_breakdown') or _EMPTY
+    payment_fee = (seller_breakdown.get('paypal_fee') or _EMPTY).get('value', '0.00')
+    net_amount = (seller_breakdown.get('net_amount') or _EMPTY).get('value', '0.00')
+
+    custom_id = purchase_unit.get("custom_id") or ""
+
+    purpose, user_email, user_name = _extract_user_fields(custom_id)
+
+    payment_info_db = {
+        'purpose': purpose,
+        'user_name': user_name,
+        'payer_name': payer_name,
+        'user_email': user_email,
+        'payer_email': payer_email,
+        'amount_value': amount_value,
+        'amount_currency': amount_currency,
+        'transaction_fee': payment_fee,
+        'net_amount': net_amount,
+        'create_time': resource.get('create_time', 'Unknown_Time')
+    }
+
+    save_record(id, 'payment', payment_info_db, items)
+
+# Maps each handled PayPal event type to its processor
+_DISPATCH = {
+    'BILLING.SUBSCRIPTION.CREATED': process_subscription_created,
+    'PAYMENT.SALE.COMPLETED': process_subscription_payment,
+    'CHECKOUT.ORDER.APPROVED': process_order_approved
+}
+
+# Response bodies that do not depend on the request are serialized once at import
+_PROCESSED_BODIES = {
+    event_type: json_dumps({'message': f'Event type {event_type} processed successfully.'})
+    for event_type in _DISPATCH
+}
+_QUEUED_BODIES = {
+    event_type: json_dumps({'message': f'Event type {event_type} queued for processing.'})
+    for event_type in _DISPATCH
+}
+_UNEXPECTED_ERROR_BODY = json_dumps({'error': 'An unexpected error occurred.'})
+
+def process_event(event_type, resource, items=None):
+    """
+    :param event_type: PayPal webhook event type
+    :param resource: Resource data from PayPal
+    :param items: Optional list collecting items for a batched write, passed through to the processors
+    :return: True if the event type was processed, False if it is not handled
+    """
+    processor = _DISPATCH.get(event_type)
+    if processor is None:
+        return False
+
+    processor(resource, items)
+    return True
+
+# BatchWriteItem accepts at most 25 items per request
+_BATCH_WRITE_SIZE = 25
+
+def write_batches(pending):
+    """
+    Writes each chunk of up to 25 items through its own batch writer. If a chunk fails, every
+    message that contributed to it is reported, since none of its items can be assumed written.
+
+    :param pending: List of (messageId, item) pairs
+    :return: messageIds whose items were not written
+    """
+    failed = []
+
+    for start in range(0, len(pending), _BATCH_WRITE_SIZE):
+        chunk = pending[start:start + _BATCH_WRITE_SIZE]
+        try:
+            with get_table().batch_writer(overwrite_by_pkeys=['id', 'data_type']) as writer:
+                for _, item in chunk:
+                    writer.put_item(Item=item)
+        except Exception:
+            logger.exception("Error writing batch of %d items", len(chunk))
+            failed.extend(message_id for message_id, _ in chunk)
+
+    return failed
+
+def process_records(records):
+    """
+    Processes a batch of SQS records, each carrying a PayPal webhook body. Items from all
+    records are collected first and then written with BatchWriteItem instead of one PutItem
+    per record.
+
+    :param records: SQS records from the Lambda event
+    :return: Partial batch response listing the records that failed
+    """
+    failures = []
+    pending = []
+
+    for record in records:
+        message_id = record.get('messageId')
+        items = []
+        try:
+            body = json_loads(record['body'])
+            validate_event_body(body)
+
+            event_type = body.get('event_type')
+            if not process_event(event_type, body.get('resource'), items):
+                logger.info("Unhandled event type: %s", event_type)
+        except ValueError as e:
+            # Invalid events will never succeed, so drop them rather than have SQS redeliver them
+            logger.warning("Dropping invalid record %s: %s", message_id, e)
+            continue
+        except Exception:
+            logger.exception("Error processing record %s", message_id)
+            failures.append(message_id)
+            continue
+
+        pending.extend((message_id, item) for item in items)
+
+    failures.extend(write_batches(pending))
+
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in dict.fromkeys(failures)]}
+
+@functools.lru_cache(maxsize=128)
+def _unhandled_event_body(event_type):
+    """
+    The event type comes from the request, and is unauthenticated when WEBHOOK_ID is not set, so the
+    cache is bounded rather than keyed on every value a caller might send.
+
+    :param event_type: Event type that has no processor
+    :return: Serialized response body
+    """
+    return json_dumps({'message': f'Event type {event_type} not processed.'})
+
+def enqueue_event(body):
+    """
+    Hands a validated webhook body to QUEUE_URL so the SQS-triggered invocation writes it in a batch.
+
+    :param body: Validated webhook body
+    """
+    get_sqs().send_message(QueueUrl=queue_url, MessageBody=json_dumps(body))
 
 def lambda_handler(event, context):
+    if 'Records' in event:
+        return process_records(event['Records'])
+
     try:
-        headers = event.get('headers', {})
+        headers = event.get('headers') or _EMPTY
         body = event['body']
-        if isinstance(body, str):
-            body = json.loads(body)
+        if not verify_paypal_webhook(headers, body):
+            raise ValueError("Invalid webhook signature.")
 
         validate_content_type(headers)
-        validate_event_body(body)
 
-        event_type = body.get('event_type')
+        if isinstance(body, (str, bytes)):
+            body = json_loads(body)
+
+        # Most PayPal event types are not handled here, so answer them before validating the resource
+        event_type = body.get('event_type') if isinstance(body, dict) else None
+        if isinstance(event_type, str) and event_type not in _DISPATCH:
+            logger.info("Unhandled event type: %s", event_type)
+            return {
+                'statusCode': 200,
+                'body': _unhandled_event_body(event_type)
+            }
+
+        validate_event_body(body)
         resource = body.get('resource')
 
-        if event_type == 'BILLING.SUBSCRIPTION.CREATED':
-            process_subscription_created(resource)
-        elif event_type == 'PAYMENT.SALE.COMPLETED':
-            process_subscription_payment(resource)
-        elif event_type == 'CHECKOUT.ORDER.APPROVED':
-            process_order_approved(resource)
-        else:
-            print(f"Unhandled event type: {event_type}")
+        if queue_url:
+            enqueue_event(body)
             return {
                 'statusCode': 200,
-                'body': json.dumps({'message': f'Event type {event_type} not processed.'})
+                'body': _QUEUED_BODIES[event_type]
             }
 
+        process_event(event_type, resource)
+
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': f'Event type {event_type} processed successfully.'})
+            'body': _PROCESSED_BODIES[event_type]
         }
 
     except ValueError as e:
-        print(f"ValueError: {str(e)}")
+        logger.warning("ValueError: %s", e)
         return {
             'statusCode': 400,
-            'body': json.dumps({'error': str(e)})
+            'body': json_dumps({'error': str(e)})
         }
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': 'An unexpected error occurred.'})
+            'body': _UNEXPECTED_ERROR_BODY
         }
\ No newline at end of file
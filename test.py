@@ -1,7 +1,50 @@
+import base64
+import datetime
 import json
 import unittest
+import urllib.error
+import zlib
 from unittest.mock import patch, MagicMock
-from index import lambda_handler
+from botocore.exceptions import ClientError
+from index import (
+    lambda_handler,
+    save_record,
+    get_table,
+    verify_paypal_webhook,
+    get_paypal_public_key,
+    validate_event_body,
+    process_subscription_payment,
+    process_order_approved,
+    _check_paypal_certificate,
+    _parse_custom_id,
+    _extract_user_fields
+)
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    rsa = None
+
+CERT_URL = 'https://api.paypal.com/v1/notifications/certs/CERT-ID'
+
+def make_certificate_pem(private_key, common_name='messageverificationcerts.paypal.com', expired=False):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    not_after = now - datetime.timedelta(days=1) if expired else now + datetime.timedelta(days=30)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=30))
+        .not_valid_after(not_after)
+        .sign(private_key, hashes.SHA256())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM)
 
 class TestLambdaHandler(unittest.TestCase):
 
@@ -84,6 +127,467 @@ class TestLambdaHandler(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertIn('Event type not processed', response['body'])
 
+class TestValidateEventBody(unittest.TestCase):
+
+    def test_validate_event_body_missing_field(self):
+        with self.assertRaisesRegex(ValueError, 'Missing required field: resource'):
+            validate_event_body({'event_type': 'PAYMENT.SALE.COMPLETED'})
+
+    def test_validate_event_body_not_an_object(self):
+        with self.assertRaisesRegex(ValueError, 'must be a JSON object'):
+            validate_event_body(['event_type', 'resource'])
+
+    def test_validate_event_body_resource_not_an_object(self):
+        with self.assertRaisesRegex(ValueError, 'resource must be an object'):
+            validate_event_body({'event_type': 'PAYMENT.SALE.COMPLETED', 'resource': None})
+
+    def test_validate_event_body_invalid_amount(self):
+        with self.assertRaisesRegex(ValueError, 'Invalid amount'):
+            validate_event_body({
+                'event_type': 'PAYMENT.SALE.COMPLETED',
+                'resource': {
+                    'billing_agreement_id': 'I-SUBSCRIPTION',
+                    'amount': {'total': 'ten', 'currency': 'USD'}
+                }
+            })
+
+    def test_validate_event_body_non_finite_amount(self):
+        for total in ('NaN', 'Infinity', '-Infinity'):
+            with self.subTest(total=total), self.assertRaisesRegex(ValueError, 'Invalid amount'):
+                validate_event_body({
+                    'event_type': 'PAYMENT.SALE.COMPLETED',
+                    'resource': {
+                        'billing_agreement_id': 'I-SUBSCRIPTION',
+                        'amount': {'total': total, 'currency': 'USD'}
+                    }
+                })
+
+    def test_validate_event_body_numeric_amount(self):
+        with self.assertRaisesRegex(ValueError, 'Invalid amount'):
+            validate_event_body({
+                'event_type': 'PAYMENT.SALE.COMPLETED',
+                'resource': {
+                    'billing_agreement_id': 'I-SUBSCRIPTION',
+                    'amount': {'total': 10.1, 'currency': 'USD'}
+                }
+            })
+
+    def test_validate_event_body_missing_amount(self):
+        with self.assertRaisesRegex(ValueError, 'Missing amount'):
+            validate_event_body({
+                'event_type': 'PAYMENT.SALE.COMPLETED',
+                'resource': {'billing_agreement_id': 'I-SUBSCRIPTION', 'amount': {'total': '10.00'}}
+            })
+
+    def test_validate_event_body_missing_purchase_units(self):
+        with self.assertRaisesRegex(ValueError, 'Missing purchase_units'):
+            validate_event_body({'event_type': 'CHECKOUT.ORDER.APPROVED', 'resource': {'purchase_units': []}})
+
+class TestParseCustomId(unittest.TestCase):
+
+    def test_parse_custom_id(self):
+        parts = _parse_custom_id('purpose:donation|email:payer@example.com|user_name:Jane:Doe')
+
+        self.assertEqual(parts, {
+            'purpose': 'donation',
+            'email': 'payer@example.com',
+            'user_name': 'Jane:Doe'
+        })
+
+    def test_parse_custom_id_skips_invalid_segments(self):
+        parts = _parse_custom_id('invalid|purpose:donation||email:')
+
+        self.assertEqual(parts, {'purpose': 'donation', 'email': ''})
+
+    def test_parse_custom_id_empty(self):
+        self.assertEqual(_parse_custom_id(''), {})
+        self.assertEqual(_parse_custom_id(None), {})
+
+    def test_extract_user_fields_defaults(self):
+        self.assertEqual(
+            _extract_user_fields('purpose:donation'),
+            ('donation', 'Unknown_Email', 'Unknown_Name')
+        )
+
+class TestProcessRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.record_body = {
+            'event_type': 'BILLING.SUBSCRIPTION.CREATED',
+            'resource': {'id': 'I-SUBSCRIPTION', 'custom_id': 'purpose:donation'}
+        }
+
+    @patch('index.get_table')
+    def test_process_records_uses_one_batch_writer(self, mock_get_table):
+        mock_table = mock_get_table.return_value
+        writer = mock_table.batch_writer.return_value.__enter__.return_value
+
+        event = {
+            'Records': [
+                {'messageId': '1', 'body': json.dumps(self.record_body)},
+                {'messageId': '2', 'body': json.dumps(self.record_body)},
+                {'messageId': '3', 'body': json.dumps({'event_type': 'BILLING.SUBSCRIPTION.CREATED'})}
+            ]
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response, {'batchItemFailures': []})
+        mock_table.batch_writer.assert_called_once()
+        self.assertEqual(writer.put_item.call_count, 2)
+        mock_table.put_item.assert_not_called()
+
+    @patch('index.get_table')
+    def test_process_records_reports_every_record_of_a_failed_flush(self, mock_get_table):
+        mock_table = mock_get_table.return_value
+        writer = mock_table.batch_writer.return_value.__enter__.return_value
+        writer.put_item.side_effect = [None] * 25 + [Exception('BatchWriteItem failed')]
+
+        event = {
+            'Records': [
+                {'messageId': str(i), 'body': json.dumps(self.record_body)}
+                for i in range(30)
+            ]
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(mock_table.batch_writer.call_count, 2)
+        self.assertEqual(
+            response,
+            {'batchItemFailures': [{'itemIdentifier': str(i)} for i in range(25, 30)]}
+        )
+
+    @patch('index.get_table')
+    def test_process_records_drops_invalid_records(self, mock_get_table):
+        writer = mock_get_table.return_value.batch_writer.return_value.__enter__.return_value
+        payment_body = {
+            'event_type': 'PAYMENT.SALE.COMPLETED',
+            'resource': {'amount': {'total': '10.00', 'currency': 'USD'}}
+        }
+        event = {
+            'Records': [
+                {'messageId': '1', 'body': json.dumps(self.record_body)},
+                {'messageId': '2', 'body': json.dumps(payment_body)}
+            ]
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response, {'batchItemFailures': []})
+        self.assertEqual(writer.put_item.call_count, 1)
+
+class TestUnhandledEventType(unittest.TestCase):
+
+    @patch('index.validate_event_body')
+    def test_unhandled_event_type_skips_body_validation(self, mock_validate_event_body):
+        event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'event_type': 'CUSTOMER.DISPUTE.CREATED'})
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertIn('Event type CUSTOMER.DISPUTE.CREATED not processed.', response['body'])
+        mock_validate_event_body.assert_not_called()
+
+    def test_missing_event_type_is_rejected(self):
+        event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'resource': {}})
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 400)
+        self.assertIn('Missing required field: event_type', response['body'])
+
+class TestHandledEventType(unittest.TestCase):
+
+    def setUp(self):
+        self.event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'event_type': 'BILLING.SUBSCRIPTION.CREATED',
+                'resource': {'id': 'I-SUBSCRIPTION', 'custom_id': 'purpose:donation'}
+            })
+        }
+
+    @patch('index.get_table')
+    def test_handled_event_type(self, mock_get_table):
+        response = lambda_handler(self.event, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(
+            json.loads(response['body']),
+            {'message': 'Event type BILLING.SUBSCRIPTION.CREATED processed successfully.'}
+        )
+        mock_get_table.return_value.put_item.assert_called_once()
+
+    @patch('index.get_table')
+    def test_unexpected_error(self, mock_get_table):
+        mock_get_table.return_value.put_item.side_effect = Exception('Connection reset')
+
+        response = lambda_handler(self.event, {})
+
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(json.loads(response['body']), {'error': 'An unexpected error occurred.'})
+
+    @patch('index.get_table')
+    def test_nan_amount_is_rejected(self, mock_get_table):
+        event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'event_type': 'PAYMENT.SALE.COMPLETED',
+                'resource': {'billing_agreement_id': 'I-SUBSCRIPTION', 'amount': {'total': 'NaN', 'currency': 'USD'}}
+            })
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 400)
+        mock_get_table.assert_not_called()
+
+class TestEnqueueEvent(unittest.TestCase):
+
+    @patch('index.get_table')
+    @patch('index.get_sqs')
+    @patch('index.queue_url', 'https://sqs.us-east-1.amazonaws.com/123456789012/paypal-events')
+    def test_lambda_handler_enqueues_when_queue_configured(self, mock_get_sqs, mock_get_table):
+        body = {
+            'event_type': 'BILLING.SUBSCRIPTION.CREATED',
+            'resource': {'id': 'I-SUBSCRIPTION'}
+        }
+        event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps(body)
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertIn('queued', response['body'])
+        mock_get_table.assert_not_called()
+        kwargs = mock_get_sqs.return_value.send_message.call_args.kwargs
+        self.assertEqual(kwargs['QueueUrl'], 'https://sqs.us-east-1.amazonaws.com/123456789012/paypal-events')
+        self.assertEqual(json.loads(kwargs['MessageBody']), body)
+
+    @patch('index.get_sqs')
+    @patch('index.queue_url', 'https://sqs.us-east-1.amazonaws.com/123456789012/paypal-events')
+    def test_lambda_handler_rejects_invalid_event_before_enqueue(self, mock_get_sqs):
+        event = {
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'event_type': 'PAYMENT.SALE.COMPLETED',
+                'resource': {'billing_agreement_id': 'I-SUBSCRIPTION', 'amount': {'total': '10.00'}}
+            })
+        }
+
+        response = lambda_handler(event, {})
+
+        self.assertEqual(response['statusCode'], 400)
+        mock_get_sqs.return_value.send_message.assert_not_called()
+
+class TestSaveRecord(unittest.TestCase):
+
+    @patch('index.get_table')
+    def test_save_record_writes_conditionally(self, mock_get_table):
+        mock_table = mock_get_table.return_value
+
+        save_record('I-SUBSCRIPTION', 'payment', {'create_time': '2024-12-01T00:00:00Z'})
+
+        mock_table.get_item.assert_not_called()
+        kwargs = mock_table.put_item.call_args.kwargs
+        self.assertEqual(kwargs['Item'], {
+            'id': 'I-SUBSCRIPTION',
+            'data_type': 'payment',
+            'create_time': '2024-12-01T00:00:00Z'
+        })
+        self.assertEqual(kwargs['ExpressionAttributeValues'], {':create_time': '2024-12-01T00:00:00Z'})
+
+    @patch('index.get_table')
+    def test_save_record_skips_redelivered_event(self, mock_get_table):
+        error = ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        mock_get_table.return_value.put_item.side_effect = error
+
+        with self.assertLogs(level='INFO') as logs:
+            save_record('I-SUBSCRIPTION', 'payment', {'create_time': '2024-12-01T00:00:00Z'})
+
+        mock_get_table.return_value.put_item.assert_called_once()
+        self.assertIn(
+            'ConditionExpression',
+            mock_get_table.return_value.put_item.call_args.kwargs
+        )
+        self.assertIn('Skipping duplicate payment record: I-SUBSCRIPTION', logs.output[0])
+
+    @patch('index.get_table')
+    def test_save_record_raises_other_errors(self, mock_get_table):
+        error = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        mock_get_table.return_value.put_item.side_effect = error
+
+        with self.assertRaises(ClientError):
+            save_record('I-SUBSCRIPTION', 'payment', {'create_time': '2024-12-01T00:00:00Z'})
+
+    def test_save_record_rejects_null_id(self):
+        with self.assertRaisesRegex(ValueError, 'Missing id'):
+            save_record(None, 'payment', {}, [])
+
+class TestGetTable(unittest.TestCase):
+
+    @patch('index.table_name', None)
+    @patch('index._table', None)
+    def test_get_table_requires_table_name(self):
+        with self.assertRaisesRegex(RuntimeError, 'TABLE_NAME'):
+            get_table()
+
+class TestProcessSubscriptionPayment(unittest.TestCase):
+
+    @patch('index.save_record')
+    def test_net_amount_is_exact(self, mock_save_record):
+        process_subscription_payment({
+            'billing_agreement_id': 'I-SUBSCRIPTION',
+            'amount': {'total': '10.10', 'currency': 'USD'},
+            'transaction_fee': {'value': '0.59'},
+            'create_time': '2024-12-01T00:00:00Z'
+        })
+
+        payment_info = mock_save_record.call_args.args[2]
+        self.assertEqual(payment_info['net_amount'], '9.51')
+
+class TestProcessOrderApproved(unittest.TestCase):
+
+    @patch('index.save_record')
+    def test_null_nested_objects_use_defaults(self, mock_save_record):
+        process_order_approved({
+            'id': 'ORDER_ID',
+            'payer': None,
+            'purchase_units': [{
+                'amount': {'value': '25.00', 'currency_code': 'USD'},
+                'payments': None,
+                'custom_id': 'purpose:donation'
+            }]
+        })
+
+        payment_info = mock_save_record.call_args.args[2]
+        self.assertEqual(payment_info['payer_name'], 'Unknown_Name Unknown_Surname')
+        self.assertEqual(payment_info['payer_email'], 'Unknown_Email')
+        self.assertEqual(payment_info['transaction_fee'], '0.00')
+        self.assertEqual(payment_info['amount_value'], '25.00')
+
+@unittest.skipUnless(rsa, 'cryptography is not installed')
+class TestVerifyPaypalWebhook(unittest.TestCase):
+
+    def setUp(self):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.body = json.dumps({'event_type': 'PAYMENT.SALE.COMPLETED', 'resource': {}})
+
+    def sign(self, body):
+        message = f"TRANSMISSION_ID|2024-12-01T00:00:00Z|WEBHOOK_ID|{zlib.crc32(body.encode())}"
+        signature = self.private_key.sign(message.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return {
+            'PAYPAL-TRANSMISSION-ID': 'TRANSMISSION_ID',
+            'PAYPAL-TRANSMISSION-TIME': '2024-12-01T00:00:00Z',
+            'PAYPAL-CERT-URL': CERT_URL,
+            'PAYPAL-AUTH-ALGO': 'SHA256withRSA',
+            'PAYPAL-TRANSMISSION-SIG': base64.b64encode(signature).decode()
+        }
+
+    @patch('index.webhook_id', 'WEBHOOK_ID')
+    @patch('index.get_paypal_public_key')
+    def test_valid_signature(self, mock_get_public_key):
+        mock_get_public_key.return_value = self.private_key.public_key()
+
+        self.assertTrue(verify_paypal_webhook(self.sign(self.body), self.body))
+
+    @patch('index.webhook_id', 'WEBHOOK_ID')
+    @patch('index.get_paypal_public_key')
+    def test_tampered_body(self, mock_get_public_key):
+        mock_get_public_key.return_value = self.private_key.public_key()
+
+        self.assertFalse(verify_paypal_webhook(self.sign(self.body), self.body.replace('{}', '{"id": "X"}')))
+
+    @patch('index.webhook_id', 'WEBHOOK_ID')
+    @patch('index.get_paypal_public_key')
+    def test_cert_url_outside_paypal(self, mock_get_public_key):
+        headers = self.sign(self.body)
+        for cert_url in (
+            'https://paypal.com.example.net/cert.pem',
+            'https://www.paypal.com/v1/notifications/certs/CERT-ID',
+            'https://api.paypal.com/redirect?to=https://example.net/cert.pem',
+            CERT_URL + '?nonce=1',
+            'http://api.paypal.com/v1/notifications/certs/CERT-ID'
+        ):
+            headers['PAYPAL-CERT-URL'] = cert_url
+            self.assertFalse(verify_paypal_webhook(headers, self.body))
+
+        mock_get_public_key.assert_not_called()
+
+@unittest.skipUnless(rsa, 'cryptography is not installed')
+class TestGetPaypalPublicKey(unittest.TestCase):
+
+    def setUp(self):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        cache_patcher = patch('index._cert_cache', {})
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    def mock_download(self, mock_opener, pem):
+        mock_opener.open.return_value.__enter__.return_value.read.return_value = pem
+
+    @patch('index._cert_opener')
+    def test_cache_hit(self, mock_opener):
+        self.mock_download(mock_opener, make_certificate_pem(self.private_key))
+
+        first = get_paypal_public_key(CERT_URL)
+        second = get_paypal_public_key(CERT_URL)
+
+        self.assertIs(first, second)
+        mock_opener.open.assert_called_once()
+
+    @patch('index._CERT_CACHE_SIZE', 2)
+    @patch('index._cert_opener')
+    def test_eviction(self, mock_opener):
+        self.mock_download(mock_opener, make_certificate_pem(self.private_key))
+
+        for cert_id in ('CERT-1', 'CERT-2', 'CERT-3'):
+            get_paypal_public_key(CERT_URL.replace('CERT-ID', cert_id))
+        get_paypal_public_key(CERT_URL.replace('CERT-ID', 'CERT-1'))
+
+        self.assertEqual(mock_opener.open.call_count, 4)
+
+    @patch('index._cert_opener')
+    def test_wrong_subject(self, mock_opener):
+        self.mock_download(mock_opener, make_certificate_pem(self.private_key, common_name='attacker.example.net'))
+
+        with self.assertRaisesRegex(ValueError, 'subject'):
+            get_paypal_public_key(CERT_URL)
+
+    @patch('index._cert_opener')
+    def test_expired_certificate(self, mock_opener):
+        self.mock_download(mock_opener, make_certificate_pem(self.private_key, expired=True))
+
+        with self.assertRaisesRegex(ValueError, 'not currently valid'):
+            get_paypal_public_key(CERT_URL)
+
+    def test_certificate_without_utc_attributes(self):
+        certificate = x509.load_pem_x509_certificate(make_certificate_pem(self.private_key, expired=True))
+        # Certificates from cryptography before 42 only expose naive not_valid_before/not_valid_after
+        legacy = MagicMock(spec=['subject', 'not_valid_before', 'not_valid_after'])
+        legacy.subject = certificate.subject
+        legacy.not_valid_before = certificate.not_valid_before_utc.replace(tzinfo=None)
+        legacy.not_valid_after = certificate.not_valid_after_utc.replace(tzinfo=None)
+
+        with self.assertRaisesRegex(ValueError, 'not currently valid'):
+            _check_paypal_certificate(legacy)
+
+    @patch('index._cert_opener')
+    def test_redirect_is_rejected(self, mock_opener):
+        mock_opener.open.side_effect = urllib.error.HTTPError(CERT_URL, 302, 'Found', {}, None)
+
+        with self.assertRaisesRegex(ValueError, 'redirected'):
+            get_paypal_public_key(CERT_URL)
+
 if __name__ == '__main__':
     unittest.main()
 